@@ -3,7 +3,7 @@ predictive_engine.py
 
 Predictive Analytics Engine for vehicle emissions:
 - Preprocessing and cleaning
-- XGBoost training with grid search + 5-fold CV
+- XGBoost training with TPE (optuna) or grid search + 5-fold CV
 - Anomaly detection with IsolationForest
 - Incremental learning (continuation of training)
 - Simple decision tree to estimate maintenance interval
@@ -14,24 +14,67 @@ Author: Generated for your research project.
 
 import os
 import json
-import time
-from typing import Dict, Any, Tuple, Optional
+import asyncio
+import itertools
+import functools
+import shutil
+import tempfile
+from typing import Dict, Any, List, Tuple, Optional
 
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split, GridSearchCV, KFold
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
+from sklearn.preprocessing import StandardScaler, OrdinalEncoder
 from sklearn.compose import ColumnTransformer
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import IsolationForest
 from sklearn.tree import DecisionTreeRegressor
 from sklearn.metrics import mean_squared_error, r2_score
 import joblib
+from joblib import Memory, Parallel, delayed
 import xgboost as xgb
 
+try:  # optional: parallel preprocessing of large frames
+    import dask.dataframe as dd
+except ImportError:
+    dd = None
+
+try:  # optional: TPE hyperparameter search
+    import optuna
+except ImportError:
+    optuna = None
+
+try:  # optional: pruning of lagging TPE trials (optuna-integration package)
+    from optuna_integration.xgboost import XGBoostPruningCallback
+except ImportError:
+    XGBoostPruningCallback = None
+
+try:  # optional: jitted traversal of the maintenance tree
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:  # optional: compiled tree ensemble for realtime inference
+    import treelite
+    import tl2cgen
+except ImportError:
+    treelite = None
+    tl2cgen = None
+
 # ---------- Configuration ----------
 MODEL_DIR = "models"
 os.makedirs(MODEL_DIR, exist_ok=True)
+# joblib cache for fitted preprocessing steps (reused when training is re-run on the same data)
+CACHE_DIR = os.path.join(MODEL_DIR, "cache")
+CACHE_BYTES_LIMIT = "500M"
+# booster served by process_realtime_batch
+BOOSTER_PATH = os.path.join(MODEL_DIR, "xgb_co2_model.json")
+# shared library produced by compile_booster (used by realtime scoring when present)
+COMPILED_MODEL_PATH = os.path.join(MODEL_DIR, "xgb_co2_model.so")
+# flat node arrays of the maintenance tree, traversed by the numba predictor
+TREE_ARRAYS_PATH = os.path.join(MODEL_DIR, "maintenance_tree.npz")
+# order of the tree arrays as passed to _tree_predict
+TREE_ARRAY_KEYS = ("feature", "threshold", "children_left", "children_right", "missing_go_to_left", "value")
 
 # Column mapping - adapt to your CSV if names differ
 COL_MAP = {
@@ -50,52 +93,161 @@ CATEGORICAL_FEATURES = ["fuel_type", "transmission_type", "manufacturer"]  # man
 
 TARGET = "co2_emissions_gPERkm"
 
+# Preprocessor output is the scaled numerics followed by ordinal-coded categoricals;
+# xgboost splits the "c" columns natively (partition splits) instead of needing one-hot columns
+FEATURE_TYPES = ["q"] * len(NUMERIC_FEATURES) + ["c"] * len(CATEGORICAL_FEATURES)
+DMATRIX_KWARGS = {"feature_types": FEATURE_TYPES, "enable_categorical": True}
+# categoricals with at most this many values still use one-hot splits inside xgboost
+MAX_CAT_TO_ONEHOT = 4
+
+# Boosting round ceiling for cv; early stopping picks the actual number of rounds
+NUM_BOOST_ROUND_MAX = 500
+CV_EARLY_STOPPING_ROUNDS = 5
+# xgboost threads per search worker / trial (workers default to cpu_count // 2)
+CV_NTHREAD = 2
+# TPE search budget and how many boosting rounds a trial runs before it may be pruned
+TPE_N_TRIALS = 20
+TPE_WARMUP_ROUNDS = 20
+# final fit: share of the training set held out for early stopping, and its patience
+FINAL_EVAL_FRACTION = 0.1
+FINAL_EARLY_STOPPING_ROUNDS = 50
+
+# Realtime anomaly gate on per-feature z-scores: below Z_NORMAL the record is accepted,
+# at or above Z_ANOMALY it is flagged, and only the band in between goes to the IsolationForest
+Z_NORMAL = 3.0
+Z_ANOMALY = 5.0
+
+# Realtime simulation: demo gap between arriving records (real system: 15*60 per vehicle),
+# how long a batch may collect records after its first one arrives, and max batch size
+SIM_ARRIVAL_INTERVAL = 0.01
+BATCH_WINDOW = 0.1
+MAX_BATCH_SIZE = 256
+
+# basic_preprocess splits frames larger than this across cores with dask (if installed)
+PARALLEL_PREPROCESS_ROWS = 1_000_000
+
+# compact dtypes applied right after reading the CSV
+LOAD_DTYPES = {
+    "fuel_type": "category",
+    "transmission_type": "category",
+    "manufacturer": "category",
+    "engine_size_cm3": "float32",
+    "power_ps": "float32",
+}
+
 # ---------- Helpers ----------
 def load_dataset(path: str) -> pd.DataFrame:
-    df = pd.read_csv(path)
+    try:
+        # multithreaded pyarrow parser; falls back to the C engine when pyarrow is not installed
+        df = pd.read_csv(path, engine="pyarrow")
+    except ImportError:
+        df = pd.read_csv(path)
     # rename columns if needed (attempt mapping)
     for k, v in COL_MAP.items():
         if k in df.columns and v not in df.columns:
             df.rename(columns={k: v}, inplace=True)
-    return df
-
-def basic_preprocess(df: pd.DataFrame) -> pd.DataFrame:
-    # Fill missing values according to your description
-    df = df.copy()
+    # categorical / float32 columns (numeric casts only where the column parsed as numeric;
+    # anything else is coerced later in basic_preprocess)
+    dtypes = {
+        col: dtype for col, dtype in LOAD_DTYPES.items()
+        if col in df.columns and (dtype == "category" or pd.api.types.is_numeric_dtype(df[col].dtype))
+    }
+    return df.astype(dtypes)
+
+def _float32_column(df: pd.DataFrame, col: str, default: float = 0.0) -> np.ndarray:
+    # fresh float32 array for a column (non-numeric entries -> NaN); missing column -> default
+    if col not in df.columns:
+        return np.full(len(df), default, dtype=np.float32)
+    values = df[col]
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        values = pd.to_numeric(values, errors="coerce")
+    return values.to_numpy(dtype=np.float32, na_value=np.nan, copy=True)
+
+def _fillna_label(values: pd.Series, value: str) -> pd.Series:
+    # fillna that also works on categorical columns whose categories lack the fill value
+    if isinstance(values.dtype, pd.CategoricalDtype) and value not in values.cat.categories:
+        values = values.cat.add_categories([value])
+    return values.fillna(value)
+
+def _power_ps_fill(df: pd.DataFrame) -> float:
+    # median used for missing power_ps, computed the same way basic_preprocess does (zero-CO2 nulls count as 0.0)
+    target = _float32_column(df, TARGET, default=np.nan)
+    power = _float32_column(df, "power_ps")
+    power[np.isnan(power) & (target == 0)] = 0.0
+    return float(np.nanmedian(power)) if not np.isnan(power).all() else np.nan
+
+def _clean_frame(df: pd.DataFrame, power_fill: Optional[float] = None) -> pd.DataFrame:
+    # row-local part of basic_preprocess; power_fill overrides the frame's own power_ps median
+    # (so dask partitions all use the median of the full frame)
+    # (shallow copy is enough: every column below is replaced, never written in place)
+    df = df.copy(deep=False)
 
     # transmission_type: fill Electric -> Automatic (if electric vehicles are represented differently)
     df["transmission_type"] = df.get("transmission_type", pd.Series(["Automatic"]*len(df)))
-    df["transmission_type"] = df["transmission_type"].fillna("Automatic")
-
-    # engine_size_cm3: null -> 0.0 for electric (or fillna 0.0)
-    df["engine_size_cm3"] = pd.to_numeric(df.get("engine_size_cm3", 0.0), errors="coerce").fillna(0.0)
-
-    # power_ps: if null but co2==0 -> fill 0.0
-    df["power_ps"] = pd.to_numeric(df.get("power_ps", 0.0), errors="coerce")
-    mask = (df["power_ps"].isna()) & (df[TARGET] == 0)
-    df.loc[mask, "power_ps"] = 0.0
-    df["power_ps"] = df["power_ps"].fillna(df["power_ps"].median())
+    df["transmission_type"] = _fillna_label(df["transmission_type"], "Automatic")
+
+    # numeric columns: one float32 array each, cleaned in place with numpy
+    target = _float32_column(df, TARGET, default=np.nan)
+    engine = _float32_column(df, "engine_size_cm3")
+    power = _float32_column(df, "power_ps")
+
+    # power_ps: if null but co2==0 -> fill 0.0, other nulls -> median
+    missing = np.isnan(power)
+    power[missing & (target == 0)] = 0.0
+    missing = np.isnan(power)
+    if missing.any():
+        if power_fill is None:
+            power_fill = np.nanmedian(power) if not missing.all() else np.nan
+        power[missing] = power_fill
 
     # fuel_type manual fixes (if blanks)
-    df["fuel_type"] = df.get("fuel_type", pd.Series(["Petrol"]*len(df))).fillna("Petrol")
+    df["fuel_type"] = _fillna_label(df.get("fuel_type", pd.Series(["Petrol"]*len(df))), "Petrol")
 
-    # Remove unrealistic negative values
-    for col in [TARGET, "engine_size_cm3", "power_ps"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0).clip(lower=0.0)
+    # Remove unrealistic negative values (remaining nulls -> 0.0 for engine_size_cm3 / electric etc.)
+    for col, arr in ((TARGET, target), ("engine_size_cm3", engine), ("power_ps", power)):
+        if col == TARGET and TARGET not in df.columns:
+            continue
+        np.nan_to_num(arr, copy=False, nan=0.0)
+        np.clip(arr, 0.0, None, out=arr)
+        df[col] = arr
 
     # Example feature engineering: power-to-weight, engine_size categorical bins etc. (extend as needed)
     # If 'weight' not present skip that part.
     return df
 
+def basic_preprocess(df: pd.DataFrame) -> pd.DataFrame:
+    # Fill missing values according to your description
+    if dd is not None and len(df) > PARALLEL_PREPROCESS_ROWS:
+        # large frames: clean partitions on all cores, with the global power_ps median
+        ddf = dd.from_pandas(df, npartitions=os.cpu_count() or 1, sort=False)
+        df = ddf.map_partitions(_clean_frame, power_fill=_power_ps_fill(df)).compute()
+    else:
+        df = _clean_frame(df)
+
+    # categorical dtype for the label columns (compact, and what the ordinal encoder / xgboost expect);
+    # done on the whole frame so categories are consistent
+    for col in CATEGORICAL_FEATURES:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+def _as_float32(X) -> np.ndarray:
+    # xgboost works in float32 internally; handing it a contiguous float32 array skips a conversion copy
+    return np.ascontiguousarray(X, dtype=np.float32)
+
 # ---------- Feature pipeline ----------
-def build_preprocessor(numeric_features=NUMERIC_FEATURES, categorical_features=CATEGORICAL_FEATURES):
+def build_preprocessor(numeric_features=NUMERIC_FEATURES, categorical_features=CATEGORICAL_FEATURES,
+                       memory: Optional[Memory] = None):
     numeric_transformer = Pipeline(steps=[
         ("scaler", StandardScaler())
     ])
+    # Categories are ordinal-coded (unknown -> NaN, i.e. missing for xgboost) and split natively by xgboost.
+    # With a joblib memory only the encoder step is memoized; the scaler is cheap to refit.
+    # Pipeline memory skips the final step, hence the trailing passthrough.
     categorical_transformer = Pipeline(steps=[
-        ("ohe", OneHotEncoder(handle_unknown="ignore", sparse=False))
-    ])
+        ("ordinal", OrdinalEncoder(handle_unknown="use_encoded_value", unknown_value=np.nan, dtype=np.float32)),
+        ("passthrough", "passthrough")
+    ], memory=memory)
 
     preprocessor = ColumnTransformer(transformers=[
         ("num", numeric_transformer, numeric_features),
@@ -105,27 +257,28 @@ def build_preprocessor(numeric_features=NUMERIC_FEATURES, categorical_features=C
     return preprocessor
 
 # ---------- Training ----------
-def train_xgboost(df: pd.DataFrame, model_path: str = None, n_jobs=4) -> Tuple[xgb.Booster, Dict[str,Any]]:
+def _eval_params(params: Dict[str, Any], X_path: str, y_path: str) -> Tuple[float, int, Dict[str, Any]]:
     """
-    Train XGBoost regressor for CO2. Returns booster and training artifacts dict.
+    Run 5-fold xgboost cv for a single grid point. Executed inside a joblib worker:
+    the data is memory-mapped from the files written by train_xgboost (no pickling
+    of the arrays per task) and xgboost threads are capped at CV_NTHREAD so that
+    workers do not oversubscribe the cores.
+    """
+    X_trans = joblib.load(X_path, mmap_mode="r")
+    y = joblib.load(y_path, mmap_mode="r")
+    dtrain = xgb.DMatrix(X_trans, label=y, **DMATRIX_KWARGS)
+    cv_params = dict(params, nthread=CV_NTHREAD)
+    cv_results = xgb.cv(cv_params, dtrain, num_boost_round=NUM_BOOST_ROUND_MAX, nfold=5, metrics="rmse",
+                        early_stopping_rounds=CV_EARLY_STOPPING_ROUNDS, seed=42, as_pandas=True)
+    rmse = cv_results["test-rmse-mean"].min()
+    rounds = cv_results.shape[0]
+    return rmse, rounds, params
+
+def _grid_search(X_trans, y: np.ndarray, base_params: Dict[str, Any], n_jobs: int) -> Tuple[float, Dict[str, Any]]:
+    """
+    Exhaustive grid search, one grid point per joblib worker.
+    Returns best cv rmse and best params (with num_boost_round).
     """
-
-    df = df.copy()
-    df = basic_preprocess(df)
-
-    # Drop rows with missing target
-    df = df[df[TARGET].notna()]
-
-    X = df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]
-    y = df[TARGET].astype(float)
-
-    # Preprocessor + create design matrix
-    preproc = build_preprocessor(NUMERIC_FEATURES, CATEGORICAL_FEATURES)
-    X_trans = preproc.fit_transform(X)
-
-    # Convert to DMatrix
-    dtrain = xgb.DMatrix(X_trans, label=y)
-
     # grid-search hyperparams (small example)
     param_grid = {
         "eta": [0.01, 0.05, 0.1],
@@ -133,54 +286,167 @@ def train_xgboost(df: pd.DataFrame, model_path: str = None, n_jobs=4) -> Tuple[x
         "subsample": [0.7, 0.9],
         "colsample_bytree": [0.6, 0.8],
     }
+    param_list = [
+        dict(base_params, eta=eta, max_depth=md, subsample=ss, colsample_bytree=cs)
+        for eta, md, ss, cs in itertools.product(
+            param_grid["eta"], param_grid["max_depth"], param_grid["subsample"], param_grid["colsample_bytree"]
+        )
+    ]
+    # dump the design matrix once; workers memory-map it instead of receiving pickled copies
+    data_dir = tempfile.mkdtemp(prefix="xgb_grid_")
+    try:
+        X_path = os.path.join(data_dir, "X_trans.joblib")
+        y_path = os.path.join(data_dir, "y.joblib")
+        joblib.dump(X_trans, X_path)
+        joblib.dump(y, y_path)
+        results = Parallel(n_jobs=n_jobs, backend="loky")(
+            delayed(_eval_params)(params, X_path, y_path) for params in param_list
+        )
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
 
-    # We'll do a manual grid search with cross validation (xgboost cv)
     best_rmse = float("inf")
     best_params = None
-    best_booster = None
-
-    for eta in param_grid["eta"]:
-        for md in param_grid["max_depth"]:
-            for ss in param_grid["subsample"]:
-                for cs in param_grid["colsample_bytree"]:
-                    params = {
-                        "objective": "reg:squarederror",
-                        "eta": eta,
-                        "max_depth": md,
-                        "subsample": ss,
-                        "colsample_bytree": cs,
-                        "tree_method": "hist",
-                        "verbosity": 0,
-                    }
-                    # 5-fold cv
-                    cv_results = xgb.cv(params, dtrain, num_boost_round=200, nfold=5, metrics="rmse", early_stopping_rounds=10, seed=42, as_pandas=True)
-                    rmse = cv_results["test-rmse-mean"].min()
-                    rounds = cv_results.shape[0]
-                    if rmse < best_rmse:
-                        best_rmse = rmse
-                        best_params = dict(params, num_boost_round=rounds)
-                    # small progress print
-                    print(f"tested eta={eta} md={md} ss={ss} cs={cs} -> rmse={rmse:.4f}")
+    for rmse, rounds, params in results:
+        if rmse < best_rmse:
+            best_rmse = rmse
+            best_params = dict(params, num_boost_round=rounds)
+        # small progress print
+        print(f"tested eta={params['eta']} md={params['max_depth']} ss={params['subsample']} cs={params['colsample_bytree']} -> rmse={rmse:.4f}")
+    return best_rmse, best_params
+
+def _tpe_search(X_trans, y: np.ndarray, base_params: Dict[str, Any], n_trials: int, n_jobs: int) -> Tuple[float, Dict[str, Any]]:
+    """
+    Optuna TPE search over the same hyperparameters as the grid, with median pruning
+    of trials whose cv rmse lags behind (when optuna-integration is installed).
+    Trials run in n_jobs threads sharing one DMatrix.
+    Returns best cv rmse and best params (with num_boost_round).
+    """
+    dtrain = xgb.DMatrix(X_trans, label=y, **DMATRIX_KWARGS)
+
+    def objective(trial):
+        params = dict(
+            base_params,
+            eta=trial.suggest_float("eta", 0.01, 0.3, log=True),
+            max_depth=trial.suggest_int("max_depth", 4, 8),
+            subsample=trial.suggest_float("subsample", 0.6, 1.0),
+            colsample_bytree=trial.suggest_float("colsample_bytree", 0.6, 1.0),
+            nthread=CV_NTHREAD,
+        )
+        # observation key is "<dataset>-<metric>"; for cv the callback reads the fold mean
+        callbacks = [XGBoostPruningCallback(trial, "test-rmse")] if XGBoostPruningCallback is not None else None
+        cv_results = xgb.cv(params, dtrain, num_boost_round=NUM_BOOST_ROUND_MAX, nfold=5, metrics="rmse",
+                            early_stopping_rounds=CV_EARLY_STOPPING_ROUNDS, seed=42, as_pandas=True,
+                            callbacks=callbacks)
+        trial.set_user_attr("num_boost_round", int(cv_results.shape[0]))
+        rmse = cv_results["test-rmse-mean"].min()
+        # small progress print
+        print(f"trial {trial.number}: {trial.params} -> rmse={rmse:.4f}")
+        return rmse
+
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    study = optuna.create_study(
+        direction="minimize",
+        sampler=optuna.samplers.TPESampler(seed=42),
+        pruner=optuna.pruners.MedianPruner(n_warmup_steps=TPE_WARMUP_ROUNDS),
+    )
+    study.optimize(objective, n_trials=n_trials, n_jobs=n_jobs)
+    best_params = dict(base_params, **study.best_params,
+                       num_boost_round=study.best_trial.user_attrs["num_boost_round"])
+    return study.best_value, best_params
+
+def train_xgboost(df: pd.DataFrame, model_path: str = None, n_jobs: Optional[int] = None, device: str = "cpu",
+                  search: str = "tpe", n_trials: int = TPE_N_TRIALS) -> Tuple[xgb.Booster, Dict[str,Any]]:
+    """
+    Train XGBoost regressor for CO2. Returns booster and training artifacts dict.
+    n_jobs: search workers, defaults to cpu_count // 2 (each runs CV_NTHREAD xgboost threads).
+    device: "cpu" or "cuda" (GPU hist).
+    search: "tpe" (optuna, n_trials trials; falls back to grid if optuna is missing) or "grid" (36 points).
+    """
+    if n_jobs is None:
+        n_jobs = max(1, (os.cpu_count() or 2) // 2)
+
+    df = basic_preprocess(df)
+
+    # Drop rows with missing target
+    df = df[df[TARGET].notna()]
+
+    # fresh RangeIndex keeps joblib's input hash for the cached encoder fit stable
+    X = df[NUMERIC_FEATURES + CATEGORICAL_FEATURES].reset_index(drop=True)
+    y = df[TARGET].astype(np.float32)
+
+    # Preprocessor + create design matrix
+    # the encoder fit cache is only worth having (and only touches disk) when training
+    memory = Memory(location=CACHE_DIR, verbose=0)
+    memory.reduce_size(bytes_limit=CACHE_BYTES_LIMIT)
+    preproc = build_preprocessor(NUMERIC_FEATURES, CATEGORICAL_FEATURES, memory=memory)
+    X_trans = _as_float32(preproc.fit_transform(X))
+
+    base_params = {
+        "objective": "reg:squarederror",
+        "tree_method": "hist",
+        "grow_policy": "lossguide",
+        "max_cat_to_onehot": MAX_CAT_TO_ONEHOT,
+        "device": device,
+        "verbosity": 0,
+    }
+    y_arr = y.to_numpy()
+    if search == "tpe" and optuna is None:
+        print("optuna not installed; falling back to grid search")
+        search = "grid"
+    if search == "tpe" and XGBoostPruningCallback is None:
+        print("optuna-integration not installed; running TPE search without trial pruning")
+    if search == "tpe":
+        best_rmse, best_params = _tpe_search(X_trans, y_arr, base_params, n_trials=n_trials, n_jobs=n_jobs)
+    elif search == "grid":
+        best_rmse, best_params = _grid_search(X_trans, y_arr, base_params, n_jobs=n_jobs)
+    else:
+        raise ValueError(f"unknown search {search!r}, expected 'tpe' or 'grid'")
     print("Best RMSE:", best_rmse, "Best params:", best_params)
 
-    # Train final booster on full training set with best params
+    # Train final booster with best params, early stopping on a held-out eval split
     num_boost = best_params.pop("num_boost_round")
     full_params = best_params
-    booster = xgb.train(full_params, dtrain, num_boost_round=num_boost)
+    X_fit, X_eval, y_fit, y_eval = train_test_split(X_trans, y_arr, test_size=FINAL_EVAL_FRACTION, random_state=42)
+    # QuantileDMatrix bins the features once and hist reuses that sketch for every round.
+    # (cv above keeps a plain DMatrix because xgb.cv slices it into folds, which QuantileDMatrix does not support.)
+    dtrain = xgb.QuantileDMatrix(X_fit, label=y_fit, max_bin=256, **DMATRIX_KWARGS)
+    deval = xgb.QuantileDMatrix(X_eval, label=y_eval, ref=dtrain, **DMATRIX_KWARGS)
+    booster = xgb.train(full_params, dtrain, num_boost_round=NUM_BOOST_ROUND_MAX, evals=[(deval, "eval")],
+                        early_stopping_rounds=FINAL_EARLY_STOPPING_ROUNDS, verbose_eval=False)
+    best_iteration = booster.best_iteration
+    print(f"Final model: best iteration {best_iteration} (cv suggested {num_boost} rounds)")
+    # keep only the trees up to the optimum: smaller model file, and every consumer (inplace_predict,
+    # compiled library, incremental updates) sees the same ensemble
+    booster = booster[: best_iteration + 1]
+
+    # per-feature mean/std for the realtime z-score anomaly gate
+    mu, sigma = df[NUMERIC_FEATURES].agg(["mean", "std"]).to_numpy()
 
     # Save preprocessor and booster
     artifacts = {
         "preprocessor": preproc,
         "best_params": full_params,
-        "num_boost_round": num_boost
+        "num_boost_round": num_boost,
+        "best_iteration": best_iteration,
+        "search": search,
+        "cv_rmse": best_rmse,
+        "numeric_stats": (mu, sigma)
     }
     if model_path is None:
-        model_path = os.path.join(MODEL_DIR, "xgb_co2_model.json")
+        model_path = BOOSTER_PATH
     preproc_path = os.path.join(MODEL_DIR, "preproc.joblib")
     joblib.dump(preproc, preproc_path)
     booster.save_model(model_path)
     joblib.dump(artifacts, os.path.join(MODEL_DIR, "artifacts.joblib"))
     print("Saved model to", model_path)
+    if os.path.abspath(model_path) == os.path.abspath(BOOSTER_PATH):
+        # a library compiled from the previous booster would keep serving old trees (possibly with an
+        # old feature layout); run compile_booster again to rebuild it
+        if os.path.exists(COMPILED_MODEL_PATH):
+            os.remove(COMPILED_MODEL_PATH)
+            print("Removed stale compiled model", COMPILED_MODEL_PATH)
+        reload_models(booster)
     return booster, artifacts
 
 # ---------- Incremental update ----------
@@ -195,120 +461,336 @@ def incremental_update(new_df: pd.DataFrame, existing_model_path: str, artifacts
     artifacts = joblib.load(artifacts_path)
     booster = xgb.Booster()
     booster.load_model(existing_model_path)
+    best_iteration = artifacts.get("best_iteration")
+    if best_iteration is not None:
+        # drop any trees past the early-stopping optimum (models saved before trimming) before adding new ones
+        booster = booster[: best_iteration + 1]
 
     # preprocess new data
     df = basic_preprocess(new_df)
     df = df[df[TARGET].notna()]
     X = df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]
-    y = df[TARGET].astype(float)
-    X_trans = preproc.transform(X)
-    dnew = xgb.DMatrix(X_trans, label=y)
+    y = df[TARGET].astype(np.float32)
+    X_trans = _as_float32(preproc.transform(X))
+    dnew = xgb.DMatrix(X_trans, label=y, **DMATRIX_KWARGS)
 
     params = artifacts["best_params"]
     # continue for small number of rounds
     booster_updated = xgb.train(params, dnew, num_boost_round=50, xgb_model=booster)
     booster_updated.save_model(existing_model_path)
+    # every tree of the continued model is used for prediction
+    artifacts["best_iteration"] = booster_updated.num_boosted_rounds() - 1
+    joblib.dump(artifacts, artifacts_path)
+    serving = os.path.abspath(existing_model_path) == os.path.abspath(BOOSTER_PATH)
+    if serving and os.path.exists(COMPILED_MODEL_PATH):
+        # the compiled library would otherwise keep serving the old trees
+        # (updates of any other booster file leave the serving library alone)
+        if tl2cgen is not None:
+            compile_booster(booster_updated)
+        else:
+            os.remove(COMPILED_MODEL_PATH)
+    # hand the serving cache the updated booster directly instead of re-reading it from disk
+    reload_models(booster_updated if serving else None)
     print("Incremental update complete; model overwritten at", existing_model_path)
     return booster_updated
 
 # ---------- Anomaly detection ----------
-def build_anomaly_detector(train_df: pd.DataFrame) -> IsolationForest:
-    # use numeric features and target residual-ish for anomaly modeling
-    df = basic_preprocess(train_df)
-    X = df[NUMERIC_FEATURES].fillna(0.0)
-    iso = IsolationForest(contamination=0.01, random_state=42)
+def _anomaly_features(X_trans: np.ndarray) -> np.ndarray:
+    # scaled numeric block of the preprocessor output (ordinal category codes carry no distance
+    # and unknown categories come out as NaN, which IsolationForest does not accept)
+    return X_trans[:, :len(NUMERIC_FEATURES)]
+
+def build_anomaly_detector(X_preprocessed: np.ndarray) -> IsolationForest:
+    """
+    Fit the IsolationForest on already preprocessed features (output of preproc.transform),
+    i.e. the same scaled feature space the booster sees; no second basic_preprocess pass.
+    """
+    X = _anomaly_features(X_preprocessed)
+    # small subsamples per tree keep fitting and scoring cheap without hurting detection
+    iso = IsolationForest(n_estimators=50, max_samples=256, contamination=0.01, random_state=42, n_jobs=-1)
     iso.fit(X)
     joblib.dump(iso, os.path.join(MODEL_DIR, "anomaly_if.joblib"))
     return iso
 
 # ---------- Maintenance Decision Tree ----------
-def train_maintenance_tree(df: pd.DataFrame) -> DecisionTreeRegressor:
+def train_maintenance_tree(df: pd.DataFrame, preproc: Optional[ColumnTransformer] = None,
+                           X_trans: Optional[np.ndarray] = None) -> DecisionTreeRegressor:
     """
     Build a toy decision tree mapping predicted emission changes to maintenance interval.
     For a production system you'd derive labels from service logs: time-to-service after a reading.
     Here we synthesize labels for demo: higher co2 -> shorter interval.
+    preproc: fitted preprocessor (e.g. artifacts["preprocessor"]); loaded from MODEL_DIR if omitted.
+    X_trans: preprocessor output for the rows of df; df must then already be basic_preprocess'ed
+    and neither basic_preprocess nor the transform runs again.
     """
-    df = basic_preprocess(df)
-    X = df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]
+    if X_trans is None:
+        df = basic_preprocess(df)
     # dummy labels: map CO2 to days-to-service inversely
     y = np.maximum(7, 180 - (df[TARGET] / df[TARGET].max()) * 180)  # between 7 and 180 days
     # preprocess features
-    preproc = joblib.load(os.path.join(MODEL_DIR, "preproc.joblib"))
-    X_trans = preproc.transform(X)
+    if X_trans is None:
+        if preproc is None:
+            preproc = joblib.load(os.path.join(MODEL_DIR, "preproc.joblib"))
+        X_trans = _as_float32(preproc.transform(df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]))
     tree = DecisionTreeRegressor(max_depth=6, random_state=42)
     tree.fit(X_trans, y)
     joblib.dump(tree, os.path.join(MODEL_DIR, "maintenance_tree.joblib"))
+    np.savez(TREE_ARRAYS_PATH, **_tree_arrays(tree))
     return tree
 
+def _tree_arrays(tree: DecisionTreeRegressor) -> Dict[str, np.ndarray]:
+    # node arrays for the numba predictor, keyed by TREE_ARRAY_KEYS (missing_go_to_left exists from sklearn 1.3 on)
+    t = tree.tree_
+    missing_left = getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=np.uint8))
+    return {"feature": t.feature, "threshold": t.threshold, "children_left": t.children_left,
+            "children_right": t.children_right, "missing_go_to_left": missing_left, "value": t.value.ravel()}
+
+def _tree_predict_py(X, feature, threshold, children_left, children_right, missing_go_to_left, value):
+    # same traversal as sklearn's tree_.apply: left if x <= threshold, NaN follows missing_go_to_left
+    out = np.empty(X.shape[0], dtype=np.float64)
+    for i in range(X.shape[0]):
+        node = 0
+        while feature[node] != -2:  # -2 marks a leaf
+            x = X[i, feature[node]]
+            if np.isnan(x):
+                go_left = missing_go_to_left[node] != 0
+            else:
+                go_left = x <= threshold[node]
+            node = children_left[node] if go_left else children_right[node]
+        out[i] = value[node]
+    return out
+
+_tree_predict = njit(cache=True)(_tree_predict_py) if njit is not None else None
+
+def _predict_maintenance(tree: DecisionTreeRegressor, tree_arrays: Optional[Tuple[np.ndarray, ...]], X_trans: np.ndarray) -> np.ndarray:
+    # jitted traversal when numba and the exported node arrays are available, sklearn otherwise
+    if tree_arrays is not None:
+        return _tree_predict(X_trans, *tree_arrays)
+    return tree.predict(X_trans)
+
+# ---------- Compiled inference (optional, needs treelite + tl2cgen) ----------
+def compile_booster(booster: xgb.Booster, libpath: str = COMPILED_MODEL_PATH, parallel_comp: int = 32) -> str:
+    """
+    Compile the booster into a shared library where every tree is generated C code,
+    avoiding xgboost's generic tree traversal on the realtime path.
+    """
+    if tl2cgen is None:
+        raise ImportError("compile_booster requires the treelite and tl2cgen packages")
+    model = treelite.frontend.from_xgboost(booster)
+    tl2cgen.export_lib(model, toolchain="gcc", libpath=libpath, params={"parallel_comp": parallel_comp})
+    print("Compiled model to", libpath)
+    return libpath
+
+def _iteration_range(best_iteration: Optional[int]) -> Tuple[int, int]:
+    # (0, 0) tells xgboost to use all trees
+    return (0, best_iteration + 1) if best_iteration is not None else (0, 0)
+
+def _predict_co2(booster: xgb.Booster, predictor, X_trans, best_iteration: Optional[int] = None) -> np.ndarray:
+    # prefer the compiled predictor when one was loaded (compiled from the saved, already trimmed booster)
+    if predictor is not None:
+        return predictor.predict(tl2cgen.DMatrix(X_trans)).ravel()
+    # inplace_predict reads the float32 array directly, no DMatrix is allocated per call
+    return booster.inplace_predict(_as_float32(X_trans), iteration_range=_iteration_range(best_iteration))
+
 # ---------- Real-time processing (called every 15 minutes) ----------
-def process_realtime_record(record: Dict[str, Any]) -> Dict[str, Any]:
+# in-memory (ubj) copy of the serving booster; rebuilding from it skips the disk read and JSON parse
+_BOOSTER_RAW: Optional[bytearray] = None
+
+def _load_booster() -> xgb.Booster:
+    global _BOOSTER_RAW
+    booster = xgb.Booster()
+    if _BOOSTER_RAW is None:
+        booster.load_model(BOOSTER_PATH)
+        _BOOSTER_RAW = booster.save_raw("ubj")
+    else:
+        booster.load_model(_BOOSTER_RAW)
+    return booster
+
+@functools.lru_cache(maxsize=1)
+def _get_models() -> Tuple[ColumnTransformer, Dict[str, Any], xgb.Booster, Any, IsolationForest, DecisionTreeRegressor,
+                           Optional[Tuple[np.ndarray, ...]]]:
     """
-    record: dict with keys vehicleId, region, timestamp, co2, nox, pm25 (or HC)
-    Returns: result dict with keys: anomaly(bool), predicted_co2(float), maintenance_days(int), action(str)
+    Load preproc and models from MODEL_DIR once; later calls return the cached tuple.
+    The compiled predictor is None unless compile_booster was run and tl2cgen is installed;
+    the tree arrays are None unless numba is installed and train_maintenance_tree exported them.
     """
-    # load preproc and models
     preproc = joblib.load(os.path.join(MODEL_DIR, "preproc.joblib"))
-    booster = xgb.Booster()
-    booster.load_model(os.path.join(MODEL_DIR, "xgb_co2_model.json"))
+    artifacts = joblib.load(os.path.join(MODEL_DIR, "artifacts.joblib"))
+    booster = _load_booster()
+    predictor = None
+    if tl2cgen is not None and os.path.exists(COMPILED_MODEL_PATH):
+        predictor = tl2cgen.Predictor(COMPILED_MODEL_PATH)
     iso = joblib.load(os.path.join(MODEL_DIR, "anomaly_if.joblib"))
     tree = joblib.load(os.path.join(MODEL_DIR, "maintenance_tree.joblib"))
+    tree_arrays = None
+    if _tree_predict is not None and os.path.exists(TREE_ARRAYS_PATH):
+        with np.load(TREE_ARRAYS_PATH) as data:
+            tree_arrays = tuple(np.ascontiguousarray(data[k]) for k in TREE_ARRAY_KEYS)
+    return preproc, artifacts, booster, predictor, iso, tree, tree_arrays
+
+def reload_models(booster: Optional[xgb.Booster] = None):
+    """
+    Drop the cached models so the next realtime call picks up updated files.
+    booster: if given, served from its in-memory bytes instead of reloading BOOSTER_PATH.
+    """
+    global _BOOSTER_RAW
+    _BOOSTER_RAW = booster.save_raw("ubj") if booster is not None else None
+    _get_models.cache_clear()
 
-    # create dataframe from record
-    df = pd.DataFrame([{
+def _realtime_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    # one feature row from an incoming record, with defaults for missing fields
+    return {
         "engine_size_cm3": float(record.get("engine_size_cm3", 0.0)),
         "power_ps": float(record.get("power_ps", 0.0)),
         "fuel_type": record.get("fuel_type", "Petrol"),
         "transmission_type": record.get("transmission_type", "Automatic"),
         "manufacturer": record.get("manufacturer", "Unknown"),
         TARGET: float(record.get("co2", 0.0))
-    }])
+    }
 
-    # anomaly check using numeric features
-    X_num = df[NUMERIC_FEATURES].fillna(0.0)
-    is_anom = iso.predict(X_num)[0] == -1
+def process_realtime_batch(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    records: list of dicts as accepted by process_realtime_record
+    Runs one transform / predict per model for the whole batch instead of one per record.
+    Returns: list of result dicts, in the same order as records
+    """
+    if not records:
+        return []
+
+    # preproc and models (loaded from disk on first call only)
+    preproc, artifacts, booster, predictor, iso, tree, tree_arrays = _get_models()
 
-    # if anomaly: flag and request more data (mock)
-    if is_anom:
-        action = "ANOMALY: request more samples or flag MVI"
-        return {"anomaly": True, "action": action, "predicted_co2": None, "maintenance_days": None}
+    # create dataframe from records
+    df = pd.DataFrame([_realtime_row(r) for r in records])
 
-    # predict co2 (use preproc)
-    X_trans = preproc.transform(df[NUMERIC_FEATURES + CATEGORICAL_FEATURES])
-    dtest = xgb.DMatrix(X_trans)
-    pred_co2 = float(booster.predict(dtest)[0])
+    # raw numeric values for the z-score gate, snapshotted before any transform touches df
+    X_num = df[NUMERIC_FEATURES].fillna(0.0).to_numpy(copy=True)
 
-    # maintenance days prediction
-    maint_days = int(tree.predict(X_trans)[0])
+    # preprocess once for all models (use preproc)
+    X_trans = _as_float32(preproc.transform(df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]))
+
+    # anomaly check using numeric features: cheap z-score gate, IsolationForest only for borderline rows
+    stats = artifacts.get("numeric_stats")
+    if stats is None:
+        # artifacts from before the gate existed
+        is_anom = iso.predict(_anomaly_features(X_trans)) == -1
+    else:
+        mu, sigma = stats
+        sigma = np.where(sigma > 0, sigma, 1.0)
+        z = np.abs((X_num - mu) / sigma).max(axis=1)
+        is_anom = z >= Z_ANOMALY
+        borderline = (z >= Z_NORMAL) & ~is_anom
+        if borderline.any():
+            is_anom[borderline] = iso.predict(_anomaly_features(X_trans[borderline])) == -1
+
+    # predict co2 and maintenance days for the non-anomalous rows only
+    ok = ~is_anom
+    pred_co2 = np.full(len(df), np.nan)
+    maint_days = np.zeros(len(df), dtype=int)
+    if ok.any():
+        X_ok = np.ascontiguousarray(X_trans[ok])
+        pred_co2[ok] = _predict_co2(booster, predictor, X_ok, artifacts.get("best_iteration"))
+        maint_days[ok] = _predict_maintenance(tree, tree_arrays, X_ok).astype(int)
 
     # Compare predicted_co2 to threshold (example threshold per fuel)
     thresholds = {"Diesel": 1500.0, "Petrol": 1200.0, "CNG": 1000.0}
-    fuel = record.get("fuel_type", "Petrol")
-    limit = thresholds.get(fuel, 1200.0)
-    compliance = pred_co2 <= limit
-
-    # Decide action
-    if not compliance:
-        action = "ALERT: predicted non-compliance -> notify user + MVI"
-    elif maint_days <= 14:
-        action = "NOTICE: recommend maintenance within {} days".format(maint_days)
-    else:
-        action = "OK"
+    limits = np.array([thresholds.get(f, 1200.0) for f in df["fuel_type"]])
+    compliance = pred_co2 <= limits
+
+    results = []
+    for i in range(len(df)):
+        # if anomaly: flag and request more data (mock)
+        if is_anom[i]:
+            action = "ANOMALY: request more samples or flag MVI"
+            results.append({"anomaly": True, "action": action, "predicted_co2": None, "maintenance_days": None})
+            continue
+
+        # Decide action
+        days = int(maint_days[i])
+        if not compliance[i]:
+            action = "ALERT: predicted non-compliance -> notify user + MVI"
+        elif days <= 14:
+            action = "NOTICE: recommend maintenance within {} days".format(days)
+        else:
+            action = "OK"
+        results.append({"anomaly": False, "predicted_co2": float(pred_co2[i]), "maintenance_days": days, "action": action})
+    return results
 
-    result = {"anomaly": False, "predicted_co2": pred_co2, "maintenance_days": maint_days, "action": action}
-    return result
+def process_realtime_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    record: dict with keys vehicleId, region, timestamp, co2, nox, pm25 (or HC)
+    Returns: result dict with keys: anomaly(bool), predicted_co2(float), maintenance_days(int), action(str)
+    """
+    return process_realtime_batch([record])[0]
 
 # ---------- Utilities ----------
-def evaluate_on_test(booster: xgb.Booster, df_test: pd.DataFrame):
-    preproc = joblib.load(os.path.join(MODEL_DIR, "preproc.joblib"))
+def evaluate_on_test(booster: xgb.Booster, df_test: pd.DataFrame, best_iteration: Optional[int] = None,
+                     preproc: Optional[ColumnTransformer] = None):
+    if preproc is None:
+        preproc = joblib.load(os.path.join(MODEL_DIR, "preproc.joblib"))
     X_test = df_test[NUMERIC_FEATURES + CATEGORICAL_FEATURES]
     y_test = df_test[TARGET].astype(float)
-    Xt = preproc.transform(X_test)
-    preds = booster.predict(xgb.DMatrix(Xt))
+    Xt = _as_float32(preproc.transform(X_test))
+    preds = booster.predict(xgb.DMatrix(Xt, **DMATRIX_KWARGS), iteration_range=_iteration_range(best_iteration))
     rmse = np.sqrt(mean_squared_error(y_test, preds))
     r2 = r2_score(y_test, preds)
     print(f"Test RMSE: {rmse:.3f}, R2: {r2:.3f}")
     return rmse, r2
 
+# ---------- Realtime simulation ----------
+async def _produce_records(queue: asyncio.Queue, df: pd.DataFrame, interval: float):
+    # push rows as incoming records, then a None sentinel
+    for i, row in df.iterrows():
+        rec = {
+            "co2": float(row[TARGET]),
+            "engine_size_cm3": float(row.get("engine_size_cm3", 0.0)),
+            "power_ps": float(row.get("power_ps", 0.0)),
+            "fuel_type": row.get("fuel_type", "Petrol"),
+            "transmission_type": row.get("transmission_type", "Automatic"),
+            "manufacturer": row.get("manufacturer", "Unknown"),
+        }
+        await queue.put((i, rec))
+        await asyncio.sleep(interval)
+    await queue.put(None)
+
+async def _consume_batches(queue: asyncio.Queue, window: float, max_batch: int):
+    # collect records for at most `window` seconds after the first one of a batch arrives
+    # (or until max_batch is reached), then score them with one process_realtime_batch call in a worker thread
+    loop = asyncio.get_running_loop()
+    batch = []
+    deadline = None
+    done = False
+    while not done:
+        timed_out = False
+        # with an empty batch wait for the next record however long it takes
+        timeout = None if deadline is None else max(0.0, deadline - loop.time())
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+        else:
+            if item is None:
+                done = True
+            else:
+                batch.append(item)
+                if deadline is None:
+                    deadline = loop.time() + window
+        if batch and (timed_out or done or len(batch) >= max_batch or loop.time() >= deadline):
+            ids = [i for i, _ in batch]
+            outs = await loop.run_in_executor(None, process_realtime_batch, [rec for _, rec in batch])
+            for i, out in zip(ids, outs):
+                print(i, out)
+            batch = []
+            deadline = None
+
+async def simulate_realtime(df: pd.DataFrame, interval: float = SIM_ARRIVAL_INTERVAL,
+                            window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH_SIZE):
+    """
+    Stream the rows of df as incoming records through an asyncio.Queue and score them in batches.
+    """
+    queue = asyncio.Queue()
+    await asyncio.gather(_produce_records(queue, df, interval), _consume_batches(queue, window, max_batch))
+
 # ---------- Example usage ----------
 if __name__ == "__main__":
     import argparse
@@ -316,6 +798,8 @@ if __name__ == "__main__":
     parser.add_argument("--train_csv", type=str, help="Path to historic dataset CSV for training", default=None)
     parser.add_argument("--do_train", action="store_true")
     parser.add_argument("--do_anomaly", action="store_true")
+    parser.add_argument("--search", choices=["tpe", "grid"], default="tpe", help="hyperparameter search strategy")
+    parser.add_argument("--compile_model", action="store_true", help="compile the trained booster with treelite for realtime scoring")
     parser.add_argument("--simulate_realtime", action="store_true", help="simulate realtime by reading new lines from CSV")
     args = parser.parse_args()
 
@@ -326,13 +810,18 @@ if __name__ == "__main__":
         df = basic_preprocess(df)
         # split
         train_df, test_df = train_test_split(df, test_size=0.2, random_state=42)
-        booster, artifacts = train_xgboost(train_df)
-        joblib.dump(artifacts, os.path.join(MODEL_DIR, "artifacts.joblib"))
-        evaluate_on_test(booster, test_df)
+        # train_xgboost saves preproc / booster / artifacts; reuse the in-memory preprocessor below
+        booster, artifacts = train_xgboost(train_df, search=args.search)
+        preproc = artifacts["preprocessor"]
+        evaluate_on_test(booster, test_df, best_iteration=artifacts["best_iteration"], preproc=preproc)
+        if args.compile_model:
+            compile_booster(booster)
+        # transform the (already cleaned) training rows once for the anomaly detector and the tree
+        X_train = _as_float32(preproc.transform(train_df[NUMERIC_FEATURES + CATEGORICAL_FEATURES]))
         if args.do_anomaly:
-            build_anomaly_detector(train_df)
+            build_anomaly_detector(X_train)
         # train maintenance tree
-        train_maintenance_tree(train_df)
+        train_maintenance_tree(train_df, X_trans=X_train)
         print("Training complete.")
 
     if args.simulate_realtime:
@@ -341,16 +830,5 @@ if __name__ == "__main__":
             raise SystemExit("Provide --train_csv to simulate")
         df = load_dataset(args.train_csv)
         df = basic_preprocess(df)
-        # simulate reading new incoming records every 15 minutes -> we'll sleep shorter for demo
-        for i, row in df.head(200).iterrows():
-            rec = {
-                "co2": float(row[TARGET]),
-                "engine_size_cm3": float(row.get("engine_size_cm3", 0.0)),
-                "power_ps": float(row.get("power_ps", 0.0)),
-                "fuel_type": row.get("fuel_type", "Petrol"),
-                "transmission_type": row.get("transmission_type", "Automatic"),
-                "manufacturer": row.get("manufacturer", "Unknown"),
-            }
-            out = process_realtime_record(rec)
-            print(i, out)
-            time.sleep(1.0)  # in real system wait 15*60
+        # simulate incoming records (every 15 minutes per vehicle in a real system; much faster for demo)
+        asyncio.run(simulate_realtime(df.head(200)))
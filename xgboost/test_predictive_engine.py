@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.tree import DecisionTreeRegressor
+
+import predictive_engine as pe
+
+
+def _fitted_preproc_and_stats():
+    rng = np.random.default_rng(0)
+    n = 200
+    df = pd.DataFrame({
+        "engine_size_cm3": rng.normal(1600.0, 300.0, n),
+        "power_ps": rng.normal(150.0, 30.0, n),
+        "fuel_type": rng.choice(["Petrol", "Diesel"], n),
+        "transmission_type": rng.choice(["Manual", "Automatic"], n),
+        "manufacturer": rng.choice(["A", "B", "C"], n),
+    })
+    preproc = pe.build_preprocessor()
+    preproc.fit(df[pe.NUMERIC_FEATURES + pe.CATEGORICAL_FEATURES])
+    mu, sigma = df[pe.NUMERIC_FEATURES].agg(["mean", "std"]).to_numpy()
+    return preproc, {"numeric_stats": (mu, sigma)}
+
+
+def test_extreme_record_is_flagged_as_anomaly(monkeypatch):
+    # the z-score gate must see the raw record, not values already scaled by preproc.transform
+    preproc, artifacts = _fitted_preproc_and_stats()
+    monkeypatch.setattr(pe, "_get_models", lambda: (preproc, artifacts, None, None, None, None, None))
+    rec = {"engine_size_cm3": 2e5, "power_ps": 150.0, "fuel_type": "Petrol",
+           "transmission_type": "Manual", "manufacturer": "A", "co2": 120.0}
+    out = pe.process_realtime_record(rec)
+    assert out["anomaly"] is True
+    assert out["predicted_co2"] is None
+
+
+def test_tree_predict_matches_sklearn_including_nan_rows():
+    # the exported node arrays must route every row, including missing values, the way sklearn does
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(500, 4)).astype(np.float32)
+    y = X[:, 0] * 3.0 - X[:, 1] + rng.normal(scale=0.1, size=500)
+    X[rng.random(X.shape) < 0.1] = np.nan
+    tree = DecisionTreeRegressor(max_depth=6, random_state=42)
+    try:
+        tree.fit(X, y)
+    except ValueError:
+        pytest.skip("sklearn without missing-value support in trees (< 1.3)")
+
+    X_test = rng.normal(size=(200, 4)).astype(np.float32)
+    X_test[::7, 0] = np.nan
+    X_test[::5, 1] = np.nan
+    X_test[3] = np.nan
+    arrays = pe._tree_arrays(tree)
+    args = tuple(np.ascontiguousarray(arrays[k]) for k in pe.TREE_ARRAY_KEYS)
+    expected = tree.predict(X_test)
+    np.testing.assert_allclose(pe._tree_predict_py(X_test, *args), expected)
+    if pe._tree_predict is not None:
+        np.testing.assert_allclose(pe._tree_predict(X_test, *args), expected)
+
+
+def _raw_frame():
+    # strings, blanks and negatives in the numeric columns; power_ps nulls with and without zero CO2
+    return pd.DataFrame({
+        "engine_size_cm3": ["1600", "abc", None, -50, 2000, 1200.5, 1400],
+        "power_ps": [100, np.nan, "x", -10, 150, np.nan, 200],
+        pe.TARGET: [120.0, 0.0, np.nan, 95.0, -3.0, 0.0, 130.0],
+        "fuel_type": ["Petrol", None, "Diesel", "Petrol", None, "Electric", "Diesel"],
+        "transmission_type": ["Manual", None, "Automatic", None, "Manual", None, "Manual"],
+        "manufacturer": ["A", "B", "C", "A", "B", "C", "A"],
+    })
+
+
+def _baseline_numeric_clean(df):
+    # the original pandas rules of basic_preprocess, kept here as the reference
+    df = df.copy()
+    df["engine_size_cm3"] = pd.to_numeric(df["engine_size_cm3"], errors="coerce").fillna(0.0)
+    df["power_ps"] = pd.to_numeric(df["power_ps"], errors="coerce")
+    mask = (df["power_ps"].isna()) & (df[pe.TARGET] == 0)
+    df.loc[mask, "power_ps"] = 0.0
+    df["power_ps"] = df["power_ps"].fillna(df["power_ps"].median())
+    for col in [pe.TARGET, "engine_size_cm3", "power_ps"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0.0).clip(lower=0.0)
+    return df
+
+
+def test_basic_preprocess_numeric_cleaning_matches_baseline_rules():
+    raw = _raw_frame()
+    out = pe.basic_preprocess(raw)
+    ref = _baseline_numeric_clean(raw)
+    for col in [pe.TARGET, "engine_size_cm3", "power_ps"]:
+        assert out[col].dtype == np.float32
+        np.testing.assert_allclose(out[col].to_numpy(), ref[col].to_numpy(dtype=np.float32))
+    assert out["fuel_type"].isna().sum() == 0
+    assert out["transmission_type"].isna().sum() == 0
+
+
+def test_parallel_basic_preprocess_matches_serial(monkeypatch):
+    pytest.importorskip("dask.dataframe")
+    rng = np.random.default_rng(2)
+    n = 400
+    # rising power_ps so every partition has its own median; the dask path must use the global one
+    power = np.arange(n, dtype=np.float64)
+    power[rng.random(n) < 0.2] = np.nan
+    target = rng.normal(130.0, 20.0, n)
+    target[::11] = 0.0
+    raw = pd.concat([_raw_frame(), pd.DataFrame({
+        "engine_size_cm3": rng.normal(1600.0, 300.0, n),
+        "power_ps": power,
+        pe.TARGET: target,
+        "fuel_type": rng.choice(["Petrol", "Diesel", None], n),
+        "transmission_type": rng.choice(["Manual", "Automatic", None], n),
+        "manufacturer": rng.choice(["A", "B", "C"], n),
+    })], ignore_index=True)
+    # categorical label columns, as load_dataset returns them
+    raw = raw.astype({col: "category" for col in pe.CATEGORICAL_FEATURES})
+
+    serial = pe.basic_preprocess(raw)
+    monkeypatch.setattr(pe, "PARALLEL_PREPROCESS_ROWS", 10)
+    parallel = pe.basic_preprocess(raw)
+    pd.testing.assert_frame_equal(parallel, serial)